@@ -1,16 +1,22 @@
 # backend/app/main.py
 from __future__ import annotations
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Protocol
+from collections import OrderedDict
 from pathlib import Path
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 import asyncio
+import json
+import os
 import shutil
 import subprocess
-import tempfile
+import time
 import uuid
 
 # =========================
@@ -21,6 +27,11 @@ APP_VERSION = "0.2.1"
 
 CORS_ORIGINS = ["http://localhost:5173"]
 
+# Render state lives in Redis when set (shared across uvicorn workers), else in-process.
+REDIS_URL = os.environ.get("REDIS_URL")
+RENDER_TTL_SECONDS = 24 * 3600      # render status is dropped after this
+RENDER_STORE_MAX = 10_000           # in-process store keeps at most this many renders
+
 FPS_DEFAULT = 30
 SLIDE_SECONDS_DEFAULT = 3.0
 XFADE_SECONDS_DEFAULT = 0.8
@@ -29,8 +40,36 @@ FREE_TIER = True
 WATERMARK_TEXT = "Made with Vibello"
 
 MAX_FILES = 25
+MAX_FILE_BYTES = 40 * 1024 * 1024
+MAX_UPLOAD_BYTES = MAX_FILES * MAX_FILE_BYTES + 1024 * 1024  # whole multipart body, plus form overhead
 ALLOWED_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
 
+# Leading-byte signatures for the formats in ALLOWED_EXTS: [(offset, magic), ...] -> ext.
+# WEBP is RIFF....WEBP, so both parts have to match.
+IMAGE_MAGIC = [
+    ([(0, b"\xff\xd8\xff")], ".jpg"),
+    ([(0, b"\x89PNG\r\n\x1a\n")], ".png"),
+    ([(0, b"RIFF"), (8, b"WEBP")], ".webp"),
+    ([(0, b"BM")], ".bmp"),
+]
+
+# Concurrency: each uvicorn worker runs at most RENDER_CONCURRENCY ffmpeg
+# processes at once, and every encode gets an equal share of the cores across
+# all workers (WEB_CONCURRENCY is uvicorn's worker count, 1 if unset).
+CPU_COUNT = os.cpu_count() or 2
+RENDER_CONCURRENCY = max(1, int(os.environ.get("RENDER_CONCURRENCY", "2")))
+WEB_WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+FFMPEG_THREADS = max(1, CPU_COUNT // (RENDER_CONCURRENCY * WEB_WORKERS))
+
+# H.264 encoders in order of preference; the first one that actually works is used.
+VIDEO_ENCODERS = {
+    "h264_nvenc": ["-c:v", "h264_nvenc", "-preset", "p4", "-rc", "vbr", "-cq", "23", "-b:v", "0"],
+    "h264_qsv": ["-c:v", "h264_qsv", "-preset", "veryfast", "-global_quality", "23"],
+    "h264_videotoolbox": ["-c:v", "h264_videotoolbox", "-b:v", "6M"],
+    "libx264": ["-c:v", "libx264", "-preset", "superfast", "-tune", "stillimage", "-crf", "23",
+                "-threads", str(FFMPEG_THREADS)],
+}
+
 # Paths
 ROOT = Path(__file__).resolve().parent.parent      # backend/
 STORAGE = ROOT / "storage"
@@ -38,15 +77,37 @@ TMP_DIR = STORAGE / "tmp"
 RENDERS_DIR = STORAGE / "renders"
 ASSETS_DIR = ROOT / "assets"
 MUSIC_FILE = ASSETS_DIR / "music" / "default.mp3"
+WATERMARK_FILE = ASSETS_DIR / "watermark.png"  # built from WATERMARK_TEXT at startup
 
 TMP_DIR.mkdir(parents=True, exist_ok=True)
 RENDERS_DIR.mkdir(parents=True, exist_ok=True)
 ASSETS_DIR.mkdir(parents=True, exist_ok=True)
 
+# Cache-Control per top-level storage dir. Renders are UUID-named and never
+# rewritten; uploads are only re-read by the editor preview.
+STORAGE_CACHE_CONTROL = {
+    "renders": "public, max-age=31536000, immutable",
+    "tmp": "public, max-age=300",
+}
+
 # =========================
 # App
 # =========================
 app = FastAPI(title=APP_NAME, version=APP_VERSION)
+
+# Registered before CORS so CORS wraps it and the browser can read the 411/413.
+@app.middleware("http")
+async def _limit_upload_size(request: Request, call_next):
+    """Refuse oversized uploads from the headers, before Starlette spools the body to disk."""
+    if request.method == "POST" and request.url.path == "/api/upload":
+        length = request.headers.get("content-length")
+        if length is None:
+            return JSONResponse({"detail": "Content-Length required."}, status_code=411)
+        if not length.isdigit() or int(length) > MAX_UPLOAD_BYTES:
+            return JSONResponse({"detail": f"Upload larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB."},
+                                status_code=413)
+    return await call_next(request)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=CORS_ORIGINS,
@@ -54,7 +115,48 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-app.mount("/storage", StaticFiles(directory=STORAGE), name="storage")
+class StorageFiles(StaticFiles):
+    """StaticFiles with a Cache-Control header chosen by storage dir (ETag comes from Starlette)."""
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        top = Path(self.get_path(scope)).parts[:1]
+        if top and top[0] in STORAGE_CACHE_CONTROL:
+            response.headers["Cache-Control"] = STORAGE_CACHE_CONTROL[top[0]]
+        return response
+
+app.mount("/storage", StorageFiles(directory=STORAGE), name="storage")
+
+@app.on_event("startup")
+async def _startup():
+    await asyncio.to_thread(_video_codec_args)  # probe the encoder once, off the event loop
+    if FREE_TIER:
+        await asyncio.to_thread(_make_watermark, WATERMARK_FILE)
+
+@app.on_event("shutdown")
+async def _shutdown():
+    PREP_POOL.shutdown(wait=False, cancel_futures=True)
+
+def _make_watermark(out_path: Path):
+    """Small translucent badge with WATERMARK_TEXT, overlaid bottom-right on free-tier renders."""
+    try:
+        from PIL import Image, ImageDraw, ImageFont
+        W, H = 420, 56
+        im = Image.new("RGBA", (W, H), (0, 0, 0, 0))
+        d = ImageDraw.Draw(im)
+        d.rounded_rectangle([0, 0, W, H], radius=12, fill=(0, 0, 0, int(255 * 0.30)))
+        try:
+            font = ImageFont.truetype("arial.ttf", 28)
+        except Exception:
+            font = ImageFont.load_default()
+        d.text((16, 14), WATERMARK_TEXT, fill=(255, 255, 255, int(255 * 0.85)), font=font)
+        # Rebuilt on every startup so a changed WATERMARK_TEXT takes effect;
+        # written via a temp file so several workers starting at once don't clash.
+        tmp = out_path.with_name(f".{out_path.name}.{os.getpid()}.tmp")
+        im.save(tmp, format="PNG")
+        os.replace(tmp, out_path)
+    except Exception:
+        pass
+
 
 # =========================
 # Health
@@ -73,6 +175,17 @@ def version():
 def _safe_name(name: str) -> str:
     return Path(name or "image").name.replace("\x00", "")
 
+def _sniff(head: bytes) -> Optional[str]:
+    """Image extension from the file's leading bytes, or None if it isn't one we accept."""
+    for sig, ext in IMAGE_MAGIC:
+        if all(head[off:off + len(magic)] == magic for off, magic in sig):
+            return ext
+    return None
+
+def _save_upload(src, target: Path):
+    with target.open("wb") as out:
+        shutil.copyfileobj(src, out, 1024 * 1024)
+
 @app.post("/api/upload")
 async def upload_images(files: List[UploadFile] = File(...)):
     if not files:
@@ -86,12 +199,25 @@ async def upload_images(files: List[UploadFile] = File(...)):
 
     saved, skipped = [], []
     for f in files:
-        if not (f.content_type and f.content_type.startswith("image/")):
+        # Per-file cap on what gets copied into the job dir; the request-level
+        # limit in _limit_upload_size is what keeps huge bodies off the disk.
+        size = f.size
+        if size is None:
+            size = f.file.seek(0, 2)
+        if size > MAX_FILE_BYTES:
+            skipped.append({"name": f.filename, "reason": "too-large"})
+            continue
+        await f.seek(0)
+        head = await f.read(12)
+        await f.seek(0)
+        ext = _sniff(head)
+        if ext is None:  # don't trust content_type, look at the bytes
             skipped.append({"name": f.filename, "reason": "not-an-image"})
             continue
         safe = _safe_name(f.filename)
-        with (job_dir / safe).open("wb") as out:
-            shutil.copyfileobj(f.file, out)
+        if Path(safe).suffix.lower() not in ALLOWED_EXTS:
+            safe += ext  # so the render step picks it up
+        await asyncio.to_thread(_save_upload, f.file, job_dir / safe)
         saved.append({"name": safe, "relpath": f"/storage/tmp/{job_id}/{safe}"})
 
     if not saved:
@@ -119,7 +245,86 @@ class RenderRequest(BaseModel):
     xfade_seconds: Optional[float] = None
     fps: Optional[int] = None
 
-RENDERS: dict[str, dict] = {}  # render_id -> {status, progress, job_id, output, error, cfg}
+class RenderStore(Protocol):
+    """render_id -> {status, progress, job_id, output, error, cfg, images}"""
+    async def get(self, render_id: str) -> Optional[dict]: ...
+    async def set(self, render_id: str, info: dict) -> None: ...
+    async def update(self, render_id: str, **fields) -> None: ...
+
+class MemoryRenderStore:
+    """Process-local store; fine for dev and a single uvicorn worker.
+
+    Bounded: least recently written renders are evicted past RENDER_STORE_MAX,
+    and anything not written for RENDER_TTL_SECONDS is dropped.
+    """
+    def __init__(self, maxsize: int = RENDER_STORE_MAX, ttl: float = RENDER_TTL_SECONDS):
+        self._data: OrderedDict[str, tuple[float, dict]] = OrderedDict()  # id -> (written_at, info)
+        self._maxsize = maxsize
+        self._ttl = ttl
+
+    def _evict(self):
+        cutoff = time.monotonic() - self._ttl
+        while self._data:
+            written_at, _ = next(iter(self._data.values()))
+            if len(self._data) <= self._maxsize and written_at >= cutoff:
+                break
+            self._data.popitem(last=False)
+
+    async def get(self, render_id: str) -> Optional[dict]:
+        self._evict()
+        entry = self._data.get(render_id)
+        return dict(entry[1]) if entry is not None else None
+
+    async def set(self, render_id: str, info: dict) -> None:
+        self._data[render_id] = (time.monotonic(), dict(info))
+        self._data.move_to_end(render_id)
+        self._evict()
+
+    async def update(self, render_id: str, **fields) -> None:
+        entry = self._data.get(render_id)
+        if entry is None:  # evicted or unknown: don't resurrect a partial record
+            return
+        entry[1].update(fields)
+        await self.set(render_id, entry[1])
+
+class RedisRenderStore:
+    """One hash per render (render:{id}); field values are JSON-encoded."""
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self._r = redis.from_url(url)
+
+    async def get(self, render_id: str) -> Optional[dict]:
+        raw = await self._r.hgetall(f"render:{render_id}")
+        if not raw:
+            return None
+        return {k.decode(): json.loads(v) for k, v in raw.items()}
+
+    async def set(self, render_id: str, info: dict) -> None:
+        key = f"render:{render_id}"
+        async with self._r.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping={k: json.dumps(v) for k, v in info.items()})
+            pipe.expire(key, RENDER_TTL_SECONDS)
+            await pipe.execute()
+
+    # HSET + EXPIRE only if the hash still exists, so an expired render isn't
+    # recreated as a partial record.
+    _UPDATE_IF_EXISTS = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+        redis.call('EXPIRE', KEYS[1], ARGV[1])
+    end
+    """
+
+    async def update(self, render_id: str, **fields) -> None:
+        args = [RENDER_TTL_SECONDS]
+        for k, v in fields.items():
+            args += [k, json.dumps(v)]
+        await self._r.eval(self._UPDATE_IF_EXISTS, 1, f"render:{render_id}", *args)
+
+RENDERS: RenderStore = RedisRenderStore(REDIS_URL) if REDIS_URL else MemoryRenderStore()
+RENDER_SEM = asyncio.Semaphore(RENDER_CONCURRENCY)
+PREP_POOL = ProcessPoolExecutor(max_workers=CPU_COUNT)  # dominant color per image
 
 @app.post("/api/render")
 async def start_render(req: RenderRequest):
@@ -127,7 +332,8 @@ async def start_render(req: RenderRequest):
     if not job_dir.exists():
         raise HTTPException(status_code=404, detail="job_id not found")
 
-    images = [p for p in job_dir.iterdir() if p.suffix.lower() in ALLOWED_EXTS]
+    images = sorted([p for p in job_dir.iterdir() if p.suffix.lower() in ALLOWED_EXTS],
+                    key=lambda p: p.name.lower())
     if not images:
         raise HTTPException(status_code=400, detail="No images found for this job_id")
 
@@ -138,21 +344,22 @@ async def start_render(req: RenderRequest):
 
     render_id = str(uuid.uuid4())
     out_file = RENDERS_DIR / f"{render_id}.mp4"
-    RENDERS[render_id] = {
+    await RENDERS.set(render_id, {
         "status": "queued",
         "progress": 0,
         "job_id": req.job_id,
         "output": str(out_file),
         "error": None,
         "cfg": {"fps": fps, "slide_s": slide_s, "xfade_s": xfade_s},
-    }
+        "images": [str(p) for p in images],
+    })
 
     asyncio.create_task(_render_worker(render_id, out_file))
     return {"render_id": render_id, "status": "queued"}
 
 @app.get("/api/render/{render_id}/status")
-def render_status(render_id: str):
-    info = RENDERS.get(render_id)
+async def render_status(render_id: str):
+    info = await RENDERS.get(render_id)
     if not info:
         raise HTTPException(status_code=404, detail="render_id not found")
     download_url = None
@@ -164,49 +371,137 @@ def render_status(render_id: str):
 # =========================
 # Helper funcs
 # =========================
-def _run(args: list[str]):
-    return subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+STDERR_TAIL_BYTES = 2000
+FFMPEG_STALL_SECONDS = 60  # kill an encode that reports no progress for this long
+
+def _stderr_tail(stream) -> str:
+    """Drain a stderr pipe, keeping only the last STDERR_TAIL_BYTES (for error messages)."""
+    tail = b""
+    for chunk in iter(lambda: stream.read(1 << 16), b""):
+        tail = (tail + chunk)[-STDERR_TAIL_BYTES:]
+    stream.close()
+    return tail.decode("utf-8", "replace")
+
+def _read_progress(stream, state: dict):
+    """Consume ffmpeg's -progress key=value lines, recording encoded seconds and when we last heard."""
+    for line in stream:
+        state["seen"] = time.monotonic()
+        if line.startswith(b"out_time_us="):
+            try:
+                state["out_s"] = int(line[len(b"out_time_us="):]) / 1e6
+            except ValueError:  # "N/A" before the first frame
+                pass
+    stream.close()
+
+async def _ffmpeg(args: list[str], render_id: Optional[str] = None, total_seconds: float = 0.0,
+                  lo: int = 0, hi: int = 100) -> subprocess.CompletedProcess:
+    """
+    Run ffmpeg under RENDER_SEM. Its -progress output is used to map encoded time
+    onto the render's progress (lo..hi) and to kill the process if it stalls.
+    The pipes are read in threads, so this works on any event loop.
+    """
+    async with RENDER_SEM:
+        proc = subprocess.Popen([args[0], "-nostats", "-progress", "pipe:1", *args[1:]],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        state = {"out_s": 0.0, "seen": time.monotonic()}
+        readers = asyncio.gather(asyncio.to_thread(_read_progress, proc.stdout, state),
+                                 asyncio.to_thread(_stderr_tail, proc.stderr))
+        stalled = False
+        shown = lo
+        try:
+            while not (await asyncio.wait({readers}, timeout=1.0))[0]:
+                if time.monotonic() - state["seen"] > FFMPEG_STALL_SECONDS:
+                    stalled = True
+                    proc.kill()
+                    await asyncio.wait({readers}, timeout=5.0)  # don't hang on pipes held open elsewhere
+                    break
+                if render_id and total_seconds > 0:
+                    pct = lo + int((hi - lo) * min(1.0, state["out_s"] / total_seconds))
+                    if pct > shown:
+                        shown = pct
+                        await RENDERS.update(render_id, progress=pct)
+            tail = readers.result()[1] if readers.done() else ""
+            returncode = await asyncio.to_thread(proc.wait)
+        finally:
+            if proc.poll() is None:  # cancelled (e.g. shutdown): don't leave ffmpeg running
+                proc.kill()
+    if stalled:
+        tail = f"No progress for {FFMPEG_STALL_SECONDS}s, killed.\n{tail}"
+    return subprocess.CompletedProcess(args, returncode, None, tail)
+
+@lru_cache(maxsize=1)
+def _video_codec_args() -> tuple[str, ...]:
+    """Pick a hardware H.264 encoder if one is usable here, else libx264."""
+    try:
+        r = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"],
+                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=15)
+        listed = r.stdout
+    except Exception:
+        listed = ""
+    for name, args in VIDEO_ENCODERS.items():
+        if name == "libx264" or name not in listed:
+            continue
+        # Being compiled in doesn't mean the device exists; do a tiny test encode.
+        try:
+            r = subprocess.run(["ffmpeg", "-hide_banner", "-f", "lavfi", "-i", "color=s=256x256:d=0.1",
+                                *args, "-f", "null", "-"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=15)
+        except Exception:
+            continue
+        if r.returncode == 0:
+            return tuple(args)
+    return tuple(VIDEO_ENCODERS["libx264"])
 
 def _dominant_color(image_path: Path) -> tuple[int,int,int]:
     """Fast approximate dominant color (average of downscaled image)."""
     try:
-        from PIL import Image, ImageStat
+        from PIL import Image
         with Image.open(image_path) as im:
-            im = im.convert("RGB")
-            im = im.resize((50, 50))
-            r, g, b = [int(x) for x in ImageStat.Stat(im).mean]
+            im.draft("RGB", (64, 64))  # JPEG: let libjpeg decode at reduced scale
+            im = im.convert("RGB").resize((1, 1), Image.BOX)
+            r, g, b = im.getpixel((0, 0))
             return r, g, b
     except Exception:
         return (168, 134, 221)  # fallback lavender
 
-def _radial_gradient_png(size: tuple[int,int], center_color: tuple[int,int,int], out_path: Path):
-    """Create a radial gradient PNG (center color -> darker edge)."""
-    from math import hypot
-    from PIL import Image
-
-    w, h = size
-    cx, cy = w / 2.0, h / 2.0
-    maxd = ( (w/2.0)**2 + (h/2.0)**2 ) ** 0.5
+DOMINANT_CACHE_MAX = 2048  # roughly MAX_FILES images for each of the last ~80 jobs
+_DOMINANT_CACHE: OrderedDict[tuple[str, int], tuple[int,int,int]] = OrderedDict()  # (path, mtime_ns) -> rgb, LRU
 
+async def _dominant_colors(images: list[Path]) -> list[tuple[int,int,int]]:
+    """Dominant color per image; cache misses are decoded in parallel on PREP_POOL."""
+    loop = asyncio.get_running_loop()
+    keys = []
+    for img in images:
+        try:
+            keys.append((str(img), img.stat().st_mtime_ns))
+        except OSError:
+            keys.append(None)
+    misses = [i for i, k in enumerate(keys) if k not in _DOMINANT_CACHE]
+    found = await asyncio.gather(*(loop.run_in_executor(PREP_POOL, _dominant_color, images[i])
+                                   for i in misses))
+    colors = [_DOMINANT_CACHE.get(k) for k in keys]
+    for k in keys:
+        if k in _DOMINANT_CACHE:
+            _DOMINANT_CACHE.move_to_end(k)
+    for i, rgb in zip(misses, found):
+        colors[i] = rgb
+        if keys[i] is not None:
+            _DOMINANT_CACHE[keys[i]] = rgb
+    while len(_DOMINANT_CACHE) > DOMINANT_CACHE_MAX:
+        _DOMINANT_CACHE.popitem(last=False)
+    return colors
+
+def _radial_gradient_src(center_color: tuple[int,int,int], frames: int, fps: int) -> str:
+    """ffmpeg source for a 1280x720 radial gradient (center color -> darker edge), held for `frames`."""
     # Precompute darker edge color (~40% of center)
     edge = tuple(max(0, int(c * 0.40)) for c in center_color)
-
-    # Build three channels separately for speed
-    r0, g0, b0 = center_color
-    r1, g1, b1 = edge
-
-    # Create blank image
-    img = Image.new("RGB", (w, h))
-    px = img.load()
-    for y in range(h):
-        for x in range(w):
-            t = min(1.0, hypot(x - cx, y - cy) / maxd)  # 0 center -> 1 edge
-            # linear blend
-            r = int(r0 * (1 - t) + r1 * t)
-            g = int(g0 * (1 - t) + g1 * t)
-            b = int(b0 * (1 - t) + b1 * t)
-            px[x, y] = (r, g, b)
-    img.save(out_path)
+    c0 = "0x%02x%02x%02x" % tuple(center_color)
+    c1 = "0x%02x%02x%02x" % edge
+    # Draw one static frame (speed=0) and repeat it, rather than redrawing every frame.
+    return (
+        f"gradients=s=1280x720:r={fps}:type=radial:c0={c0}:c1={c1}:x0=640:y0=360:x1=0:y1=0:speed=0,"
+        f"trim=end_frame=1,loop=loop={frames - 1}:size=1,setpts=N/{fps}/TB"
+    )
 
 # =========================
 # Render worker (Option C: gradient background)
@@ -222,167 +517,85 @@ async def _render_worker(render_id: str, out_file: Path):
       - Add music + PNG watermark.
     """
     try:
-        info = RENDERS[render_id]
-        info["status"] = "processing"; info["progress"] = 5
+        info = await RENDERS.get(render_id)
+        await RENDERS.update(render_id, status="processing", progress=5)
         cfg = info["cfg"]; fps = cfg["fps"]; SLIDE = cfg["slide_s"]; XFADE = cfg["xfade_s"]
 
-        job_dir = TMP_DIR / info["job_id"]
-        images = sorted([p for p in job_dir.iterdir() if p.suffix.lower() in ALLOWED_EXTS],
-                        key=lambda p: p.name.lower())
+        images = [Path(p) for p in info["images"]]  # scanned once in start_render
         if not images:
             raise RuntimeError("No images found for this job.")
 
-        work = Path(tempfile.mkdtemp(prefix=f"render_{render_id}_", dir=str(RENDERS_DIR)))
-        segs: list[Path] = []
-
-        # --- 1) Per-image segments (gradient bg + fit foreground) ---
-        for idx, img in enumerate(images, start=1):
-            seg = work / f"seg_{idx:03d}.mp4"
-            bg = work / f"bg_{idx:03d}.png"
-
-            # Make gradient background
-            base = _dominant_color(img)
-            _radial_gradient_png((1280, 720), base, bg)
-
-            # Two inputs: bg then foreground photo
-            # - Loop each for SLIDE seconds
-            # - Scale fg to fit (no upscale), then overlay centered onto bg
-            vf = (
-                "[1:v]scale=w='min(iw,1280)':h='min(ih,720)':force_original_aspect_ratio=decrease[fg];"
-                "[0:v][fg]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)/2,"
-                f"fps={fps},format=yuv420p,setsar=1[v]"
-            )
-            cmd = [
-                "ffmpeg", "-y",
-                "-loop", "1", "-t", f"{SLIDE}", "-i", str(bg),
-                "-loop", "1", "-t", f"{SLIDE}", "-i", str(img),
-                "-filter_complex", vf, "-map", "[v]",
-                "-r", str(fps), "-an",
-                "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
-                "-pix_fmt", "yuv420p",
-                str(seg),
-            ]
-            r = await asyncio.to_thread(_run, cmd)
-            if r.returncode != 0:
-                raise RuntimeError(f"FFmpeg segment failed for {img.name}:\n{r.stderr[-1500:]}")
-
-            segs.append(seg)
-            info["progress"] = 5 + int(60 * idx / max(len(images), 1))
-
-        # --- 2) Stitch with xfade (increasing offsets) ---
-        if len(segs) == 1:
-            cmd = ["ffmpeg", "-y", "-i", str(segs[0]),
-                   "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
-                   "-pix_fmt", "yuv420p", str(out_file)]
-            r = await asyncio.to_thread(_run, cmd)
-            if r.returncode != 0:
-                raise RuntimeError(f"FFmpeg final (single) failed:\n{r.stderr[-1500:]}")
-        else:
-            cmd = ["ffmpeg", "-y"]
-            for p in segs: cmd += ["-i", str(p)]
-            steps = []
-            last = "[0:v]"
-            for i in range(1, len(segs)):
-                outlbl = f"[v{i}]"
-                offset = i * (SLIDE - XFADE)
-                steps.append(
-                    f"{last}[{i}:v]xfade=transition=fade:duration={XFADE}:offset={offset:.3f},"
-                    "format=yuv420p" + outlbl
-                )
-                last = outlbl
-            filtergraph = ";".join(steps)
-            cmd += ["-filter_complex", filtergraph, "-map", last,
-                    "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
-                    "-pix_fmt", "yuv420p", str(out_file)]
-            r = await asyncio.to_thread(_run, cmd)
-            if r.returncode != 0:
-                raise RuntimeError(f"FFmpeg xfade failed:\n{r.stderr[-2000:]}")
-
-        # --- 3) Music + PNG watermark (same as before) ---
-        video_only = out_file.with_suffix(".video.mp4")
-        out_file.rename(video_only)
-        final_out = out_file
-
-        N = len(segs)
+        # --- 1) Dominant colors, computed in parallel on PREP_POOL ---
+        colors = await _dominant_colors(images)
+        await RENDERS.update(render_id, progress=20)
+
+        N = len(images)
         total_seconds = max(N * SLIDE - (N - 1) * XFADE, 0.5)
         fade_out_start = max(total_seconds - 0.8, 0.0)
 
-        # Make small watermark PNG on the fly
-        wm_path = None
-        if FREE_TIER:
-            try:
-                from PIL import Image, ImageDraw, ImageFont
-                W, H = 420, 56
-                im = Image.new("RGBA", (W, H), (0, 0, 0, 0))
-                d = ImageDraw.Draw(im)
-                d.rounded_rectangle([0, 0, W, H], radius=12, fill=(0, 0, 0, int(255 * 0.30)))
-                try:
-                    font = ImageFont.truetype("arial.ttf", 28)
-                except Exception:
-                    font = ImageFont.load_default()
-                d.text((16, 14), WATERMARK_TEXT, fill=(255, 255, 255, int(255 * 0.85)), font=font)
-                wm_path = RENDERS_DIR / f"{render_id}_wm.png"
-                im.save(wm_path)
-            except Exception:
-                wm_path = None
-
-        if MUSIC_FILE.exists() and wm_path:
-            cmd = [
-                "ffmpeg", "-y",
-                "-i", str(video_only), "-stream_loop", "-1", "-i", str(MUSIC_FILE), "-i", str(wm_path),
-                "-shortest",
-                "-filter_complex", "[0:v][2:v]overlay=main_w-overlay_w-24:main_h-overlay_h-24[v]",
-                "-map", "[v]", "-map", "1:a",
-                "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
-                "-pix_fmt", "yuv420p",
-                "-c:a", "aac", "-b:a", "192k",
-                "-af", f"afade=t=in:st=0:d=0.5,afade=t=out:st={fade_out_start:.2f}:d=0.8",
-                str(final_out),
-            ]
-        elif MUSIC_FILE.exists():
-            cmd = [
-                "ffmpeg", "-y",
-                "-i", str(video_only), "-stream_loop", "-1", "-i", str(MUSIC_FILE),
-                "-shortest",
-                "-map", "0:v", "-map", "1:a",
-                "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
-                "-pix_fmt", "yuv420p",
-                "-c:a", "aac", "-b:a", "192k",
-                "-af", f"afade=t=in:st=0:d=0.5,afade=t=out:st={fade_out_start:.2f}:d=0.8",
-                str(final_out),
-            ]
-        elif wm_path:
-            cmd = [
-                "ffmpeg", "-y",
-                "-i", str(video_only), "-i", str(wm_path),
-                "-filter_complex", "[0:v][1:v]overlay=main_w-overlay_w-24:main_h-overlay_h-24[v]",
-                "-map", "[v]",
-                "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
-                "-pix_fmt", "yuv420p",
-                str(final_out),
-            ]
+        wm_path = WATERMARK_FILE if FREE_TIER and WATERMARK_FILE.exists() else None
+
+        # --- 2) Slides + xfade + music + watermark in one pass ---
+        # Each photo is an input looped for SLIDE seconds. Its background is a
+        # radial gradient drawn inside the graph; slides whose colors match to
+        # 5 bits per channel share one gradient via split.
+        # Per slide: scale fg to fit (no upscale), overlay centered onto bg -> [s{i}].
+        # Then chain the slides with xfade (increasing offsets), overlay the
+        # watermark bottom-right and mux the looped music track.
+        frames = max(1, round(SLIDE * fps))
+        buckets: dict[tuple[int,int,int], list[int]] = {}  # 5-bit quantized color -> slide indices
+        for i, base in enumerate(colors):
+            buckets.setdefault((base[0] >> 3, base[1] >> 3, base[2] >> 3), []).append(i)
+
+        cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"]
+        steps = []
+        for slides in buckets.values():
+            labels = "".join(f"[bg{i}]" for i in slides)
+            steps.append(f"{_radial_gradient_src(colors[slides[0]], frames, fps)},split={len(slides)}{labels}")
+        for i, img in enumerate(images):
+            cmd += ["-loop", "1", "-t", f"{SLIDE}", "-i", str(img)]
+            steps.append(
+                f"[{i}:v]scale=w='min(iw,1280)':h='min(ih,720)':force_original_aspect_ratio=decrease[fg{i}];"
+                f"[bg{i}][fg{i}]overlay=(main_w-overlay_w)/2:(main_h-overlay_h)/2,"
+                f"fps={fps},format=yuv420p,setsar=1[s{i}]"
+            )
+        last = "[s0]"
+        for i in range(1, N):
+            outlbl = f"[v{i}]"
+            offset = i * (SLIDE - XFADE)
+            steps.append(
+                f"{last}[s{i}]xfade=transition=fade:duration={XFADE}:offset={offset:.3f},"
+                "format=yuv420p" + outlbl
+            )
+            last = outlbl
+
+        next_input = N
+        music_idx = None
+        if MUSIC_FILE.exists():
+            cmd += ["-stream_loop", "-1", "-i", str(MUSIC_FILE)]
+            music_idx = next_input; next_input += 1
+        if wm_path:
+            cmd += ["-i", str(wm_path)]
+            steps.append(f"{last}[{next_input}:v]overlay=main_w-overlay_w-24:main_h-overlay_h-24[vout]")
+            last = "[vout]"
+
+        filtergraph = ";".join(steps)
+        cmd += ["-filter_complex", filtergraph, "-map", last, "-r", str(fps),
+                *_video_codec_args(), "-pix_fmt", "yuv420p"]
+        if music_idx is not None:
+            cmd += ["-map", f"{music_idx}:a", "-shortest",
+                    "-c:a", "aac", "-b:a", "192k",
+                    "-af", f"afade=t=in:st=0:d=0.5,afade=t=out:st={fade_out_start:.2f}:d=0.8"]
         else:
-            cmd = [
-                "ffmpeg", "-y", "-i", str(video_only),
-                "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
-                "-pix_fmt", "yuv420p",
-                str(final_out),
-            ]
-        r = await asyncio.to_thread(_run, cmd)
+            cmd += ["-an"]
+        cmd += ["-movflags", "+faststart", str(out_file)]  # moov up front: playback starts while downloading
+        r = await _ffmpeg(cmd, render_id, total_seconds, lo=20, hi=99)
         if r.returncode != 0:
-            raise RuntimeError(f"Audio/overlay failed:\n{r.stderr[-1500:]}")
+            raise RuntimeError(f"FFmpeg render failed:\n{r.stderr}")
 
-        # Cleanup
-        try: video_only.unlink(missing_ok=True)
-        except Exception: pass
-        try:
-            if 'wm_path' in locals() and wm_path:
-                Path(wm_path).unlink(missing_ok=True)
-        except Exception:
-            pass
-
-        info["progress"] = 100; info["status"] = "done"
+        await RENDERS.update(render_id, progress=100, status="done")
 
     except Exception as e:
-        RENDERS[render_id]["status"] = "error"
-        RENDERS[render_id]["error"] = str(e) or repr(e)
+        out_file.unlink(missing_ok=True)  # don't leave a partial render behind
+        await RENDERS.update(render_id, status="error", error=str(e) or repr(e))
+